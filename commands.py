@@ -1,6 +1,8 @@
 from datetime import datetime
 import os
-from typing import Any, Callable
+from typing import Any, Awaitable, Callable
+
+from messages import Message
 
 
 def cmd_list(state: Any) -> None:
@@ -15,35 +17,35 @@ def cmd_new(state: Any) -> None:
     print("Started a new conversation.")
 
 
-def cmd_exit(
+async def cmd_exit(
     state: Any,
-    generate_title_from_mem: Callable[[Any], str],
+    generate_title_from_mem: Callable[[Any], Awaitable[str]],
     sanitize_filename: Callable[[str], str],
-    save_conversation: Callable[[Any, str], None],
+    save_conversation: Callable[[Any, str], Awaitable[None]],
 ) -> None:
     if not state.mem:
         raise SystemExit
 
     if state.current_name:
-        save_conversation(state, state.current_name)
+        await save_conversation(state, state.current_name)
         print(f"Saved as: {state.current_name}")
         raise SystemExit
 
-    title = generate_title_from_mem(state)
+    title = await generate_title_from_mem(state)
     print(title)
 
     name = sanitize_filename(title) or datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    save_conversation(state, name)
+    await save_conversation(state, name)
 
     print(f"Saved as: {state.current_name}")
     raise SystemExit
 
 
-def cmd_load(state: Any, arg: str, load_conversation: Callable[[Any, str], None]) -> None:
+async def cmd_load(state: Any, arg: str, load_conversation: Callable[[Any, str], Awaitable[None]]) -> None:
     if not arg:
         print("Usage: load <name>")
         return
-    load_conversation(state, arg)
+    await load_conversation(state, arg)
 
 
 def cmd_delete(state: Any, arg: str) -> None:
@@ -56,7 +58,7 @@ def cmd_delete(state: Any, arg: str) -> None:
         print("No conversation found with that name.")
         return
 
-    path = os.path.join(state.history_dir, f"{arg}.json")
+    path = entry["_path"]
     if not os.path.exists(path):
         print("Conversation file not found on disk.")
         return
@@ -64,6 +66,8 @@ def cmd_delete(state: Any, arg: str) -> None:
     os.remove(path)
     state.history = [item for item in state.history if item["name"] != arg]
     state.history_by_name.pop(arg, None)
+    state.history_names_lower = [pair for pair in state.history_names_lower if pair[1] != arg]
+    state.history_dir_mtime_ns = None
 
     if state.current_name == arg:
         state.current_name = None
@@ -77,25 +81,25 @@ def cmd_help(command_table: list[dict]) -> None:
         print(f"  {command['command']:<16} {command['description']}")
 
 
-def cmd_reload(state: Any, load_history: Callable[[Any], None]) -> None:
-    load_history(state)
+async def cmd_reload(state: Any, load_history: Callable[[Any], Awaitable[None]]) -> None:
+    await load_history(state)
 
 
-def cmd_compress(state: Any, model_reply: Callable[[Any, list[dict]], str]) -> None:
+async def cmd_compress(state: Any, model_reply: Callable[[Any, list[Message]], Awaitable[str]]) -> None:
     if not state.mem:
         print("Nothing to compress.")
         return
 
     state.mem.append(
-        {
-            "role": "user",
-            "content": (
+        Message(
+            "user",
+            (
                 "Take all conversation context so far and condense it into a comprehensive summary "
                 "that preserves key facts, decisions, constraints, and open tasks."
             ),
-        }
+        )
     )
 
-    summary = model_reply(state, state.mem)
-    state.mem = [{"role": "assistant", "content": summary}]
+    summary = await model_reply(state, state.mem)
+    state.mem = [Message("assistant", summary)]
     print("Conversation compressed.")
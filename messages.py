@@ -0,0 +1,18 @@
+from dataclasses import dataclass
+import sys
+
+
+@dataclass(slots=True)
+class Message:
+    role: str
+    content: str
+
+
+def to_wire(message: Message) -> dict:
+    """Plain dict form used by the OpenAI SDK and the history JSON."""
+    return {"role": message.role, "content": message.content}
+
+
+def from_wire(data: dict) -> Message:
+    # only a handful of roles exist; intern them so loaded messages share one string each
+    return Message(sys.intern(data["role"]), data["content"])
@@ -1,10 +1,34 @@
+import asyncio
+import bisect
 from dataclasses import dataclass, field
 from datetime import datetime
+import hashlib
+import inspect
+import itertools
 import json
 import os
-from openai import OpenAI
+import time
+from typing import Iterable
+import aiofiles
+import aiofiles.os
+import httpx
+from openai import AsyncOpenAI
 from prompt_toolkit import PromptSession
 from prompt_toolkit.completion import Completer, Completion
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import h2  # noqa: F401  (httpx only needs it importable for http2=True)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+from messages import Message, from_wire, to_wire
 from commands import cmd_compress, cmd_delete, cmd_exit, cmd_help, cmd_list, cmd_load, cmd_new, cmd_reload
 
 YELLOW = "\033[33m"
@@ -13,132 +37,343 @@ RESET = "\033[0m"
 TITLE_PROMPT = "Summarize this conversation into a three word title. No punctuation."
 INVALID_FILENAME_CHARS = '<>:"/\\|?*'
 WINDOWS_RESERVED = {"CON", "PRN", "AUX", "NUL", "COM1", "COM2", "COM3", "COM4", "COM5", "COM6", "COM7", "COM8", "COM9", "LPT1", "LPT2", "LPT3", "LPT4", "LPT5", "LPT6", "LPT7", "LPT8", "LPT9"}
+_STRIP_TABLE = str.maketrans("", "", INVALID_FILENAME_CHARS)
+_WINDOWS_RESERVED_MAX_LEN = max(map(len, WINDOWS_RESERVED))
+HISTORY_INDEX_FILE = ".index.json"
+TITLE_CACHE_FILE = ".title_cache.json"
+SIDECAR_FILES = {HISTORY_INDEX_FILE, TITLE_CACHE_FILE}
+HEADER_READ_SIZE = 4096
+# aiofiles opens every queued file before reading any, so keep well under the fd limit
+MAX_HEADER_READS = 32
+# new files are written compressed when zstandard is installed; plain .json is always readable
+HISTORY_SUFFIXES = (".json", ".json.zst")
+HISTORY_SUFFIX = ".json.zst" if zstandard is not None else ".json"
+
+
+def json_loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj, indent: bool = False) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None).encode("utf-8")
+
+
+# zstd contexts are expensive to set up relative to one small payload, so share them
+_ZSTD_COMPRESSOR = zstandard.ZstdCompressor(level=3) if zstandard is not None else None
+_ZSTD_DECOMPRESSOR = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+
+def encode_history(entry: dict) -> bytes:
+    if _ZSTD_COMPRESSOR is not None:
+        return _ZSTD_COMPRESSOR.compress(json_dumps(entry))
+    return json_dumps(entry, indent=True)
+
+
+def decode_history(path: str, data: bytes, limit: int = -1) -> bytes:
+    """Return the raw JSON for a history file, or just its first `limit` bytes."""
+    if not path.endswith(".zst"):
+        return data if limit < 0 else data[:limit]
+    if _ZSTD_DECOMPRESSOR is None:
+        raise ValueError(f"zstandard is required to read {path}")
+    try:
+        if limit < 0:
+            return _ZSTD_DECOMPRESSOR.decompress(data)
+        # only inflate as many blocks as the header needs
+        return _ZSTD_DECOMPRESSOR.stream_reader(data).read(limit)
+    except zstandard.ZstdError as e:
+        # ZstdError isn't a ValueError; normalize so callers handle one decode error type
+        raise ValueError(f"corrupt zstd history file {path}: {e}") from e
 
 
 def sanitize_filename(name: str) -> str:
-    for ch in INVALID_FILENAME_CHARS:
-        name = name.replace(ch, "")
-    name = name.strip()
-    if name.upper() in WINDOWS_RESERVED:
+    name = name.translate(_STRIP_TABLE).strip()
+    # no reserved name is longer than _WINDOWS_RESERVED_MAX_LEN, so skip the upper() copy
+    if len(name) <= _WINDOWS_RESERVED_MAX_LEN and name.upper() in WINDOWS_RESERVED:
         name = f"_{name}"
     return name
 
 
 def unique_path(base_dir: str, name: str) -> tuple[str, str]:
-    """Return (final_name, path) with -2/-3 suffix if needed."""
-    base = name
-    path = os.path.join(base_dir, f"{base}.json")
-    if not os.path.exists(path):
-        return base, path
+    """Reserve and return (final_name, path) with -2/-3 suffix if needed.
 
+    The slot is claimed with O_EXCL; each candidate also costs one stat per other
+    history suffix so .json and .json.zst files never share a name.
+    """
+    candidate = name
     i = 2
     while True:
-        candidate = f"{base}-{i}"
-        path = os.path.join(base_dir, f"{candidate}.json")
-        if not os.path.exists(path):
-            return candidate, path
-        i += 1
+        filename = f"{candidate}{HISTORY_SUFFIX}"
+        path = os.path.join(base_dir, filename)
+        try:
+            # a title like ".index" would otherwise overwrite our own sidecar
+            if filename in SIDECAR_FILES:
+                raise FileExistsError
+            # a file in the other on-disk format owns the name too
+            for suffix in HISTORY_SUFFIXES:
+                if suffix != HISTORY_SUFFIX and os.path.exists(os.path.join(base_dir, f"{candidate}{suffix}")):
+                    raise FileExistsError
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            candidate = f"{name}-{i}"
+            i += 1
+            continue
+        os.close(fd)
+        return candidate, path
 
 
 @dataclass
 class AppState:
-    client: OpenAI
+    client: AsyncOpenAI
     session: PromptSession
     history_dir: str
 
     current_name: str | None = None
-    mem: list[dict] = field(default_factory=list)
+    mem: list[Message] = field(default_factory=list)
 
     history: list[dict] = field(default_factory=list)
     history_by_name: dict[str, dict] = field(default_factory=dict)
+    # (lowercased, original) pairs kept sorted so completion can bisect to the prefix
+    history_names_lower: list[tuple[str, str]] = field(default_factory=list)
+    history_dir_mtime_ns: int | None = None
+    history_last_scan: float | None = None
+    title_cache: dict[str, str] = field(default_factory=dict)
 
 
 class AiCLICompleter(Completer):
     def __init__(self, state: AppState, command_table: list[dict]):
         self.state = state
         self.command_table = command_table
+        self.command_names = tuple(entry["command"] for entry in command_table)
 
     def get_completions(self, document, complete_event):
         text = document.text_before_cursor
         lower_text = text.lower()
 
         if " " not in text:
-            for cmd in (entry["command"] for entry in self.command_table):
+            for cmd in self.command_names:
                 if cmd.startswith(lower_text):
                     yield Completion(cmd, start_position=-len(text))
 
         command_name, separator, remainder = text.partition(" ")
         if separator and command_name.lower() in {"load", "delete"}:
             prefix = remainder
-            for n in self.state.history_by_name.keys():
-                if n.lower().startswith(prefix.lower()):
-                    yield Completion(n, start_position=-len(prefix))
-
+            prefix_lower = prefix.lower()
+            names = self.state.history_names_lower
+            i = bisect.bisect_left(names, (prefix_lower,))
+            while i < len(names) and names[i][0].startswith(prefix_lower):
+                yield Completion(names[i][1], start_position=-len(prefix))
+                i += 1
+
+
+async def read_sidecar(history_dir: str, filename: str) -> dict:
+    """Return the dict stored in a history_dir sidecar file, or {} if missing/corrupt."""
+    path = os.path.join(history_dir, filename)
+    try:
+        async with aiofiles.open(path, "rb") as f:
+            data = json_loads(await f.read())
+        if isinstance(data, dict):
+            return data
+    except Exception:
+        pass
+    return {}
+
+
+async def write_sidecar(history_dir: str, filename: str, data: dict) -> None:
+    path = os.path.join(history_dir, filename)
+    tmp_path = f"{path}.tmp"
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            await f.write(json_dumps(data))
+        await aiofiles.os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+async def read_history_header(path: str) -> dict:
+    """Parse only name/created from the top of a history file, stopping before "conversation"."""
+    compressed = path.endswith(".zst")
+    async with aiofiles.open(path, "rb") as f:
+        # compressed files are small; read them whole and inflate only the head
+        raw = await f.read() if compressed else await f.read(HEADER_READ_SIZE)
+        head = decode_history(path, raw, HEADER_READ_SIZE)
+        cut = head.find(b'"conversation"')
+        if cut != -1:
+            try:
+                header = json_loads(head[:cut].rstrip().rstrip(b",") + b"}")
+                if isinstance(header, dict) and {"name", "created"} <= header.keys():
+                    return {"name": header["name"], "created": header["created"]}
+            except ValueError:
+                pass
+
+        # header isn't laid out the way save_conversation writes it -> parse the whole file
+        if not compressed:
+            await f.seek(0)
+            raw = await f.read()
+        entry = json_loads(decode_history(path, raw))
+    if not (isinstance(entry, dict) and {"name", "created", "conversation"} <= entry.keys()):
+        raise ValueError(f"not a conversation file: {path}")
+    return {"name": entry["name"], "created": entry["created"]}
+
+
+async def load_history(state: AppState) -> None:
+    # nothing added/removed since the last scan -> in-memory index is still good
+    dir_mtime_ns = os.stat(state.history_dir).st_mtime_ns
+    if state.history and dir_mtime_ns == state.history_dir_mtime_ns:
+        print(f"Loaded {len(state.history)} conversations from history.")
+        return
 
-def load_history(state: AppState) -> None:
     state.history.clear()
     state.history_by_name.clear()
 
-    for file in os.listdir(state.history_dir):
-        if not file.lower().endswith(".json"):
-            continue
-        path = os.path.join(state.history_dir, file)
+    if not state.title_cache:
+        state.title_cache = await read_sidecar(state.history_dir, TITLE_CACHE_FILE)
+
+    # {filename: {"mtime", "size", "entry"}}
+    cache = await read_sidecar(state.history_dir, HISTORY_INDEX_FILE)
+    fresh = {}
+
+    # history files are ones we wrote, so always lowercase .json/.json.zst; titles may start with a dot,
+    # so only our exact sidecar names are skipped
+    with os.scandir(state.history_dir) as it:
+        entries = [e for e in it if e.is_file() and e.name.endswith(HISTORY_SUFFIXES) and e.name not in SIDECAR_FILES]
+
+    files = []
+    for file in entries:
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                entry = json.load(f)
-            if isinstance(entry, dict) and {"name", "created", "conversation"} <= entry.keys():
-                state.history.append(entry)
-                state.history_by_name[entry["name"]] = entry
-        except Exception:
+            # served from the scandir record on Windows, no extra syscall
+            files.append((file, file.stat()))
+        except OSError:
             pass
 
+    def cached_header(file, st):
+        cached = cache.get(file.name)
+        if not (isinstance(cached, dict) and cached.get("mtime") == st.st_mtime_ns and cached.get("size") == st.st_size):
+            return None
+        header = cached.get("entry")
+        # a malformed index entry falls back to re-reading the file
+        if isinstance(header, dict) and {"name", "created"} <= header.keys():
+            return header
+        return None
+
+    header_slots = asyncio.Semaphore(MAX_HEADER_READS)
+
+    async def bounded_header(path):
+        async with header_slots:
+            return await read_history_header(path)
+
+    # read every header the index couldn't answer concurrently
+    stale = [file for file, st in files if cached_header(file, st) is None]
+    parsed = await asyncio.gather(*(bounded_header(file.path) for file in stale), return_exceptions=True)
+    read_failed = any(isinstance(header, OSError) for header in parsed)
+    parsed_by_name = {file.name: header for file, header in zip(stale, parsed)}
+
+    for file, st in files:
+        header = parsed_by_name[file.name] if file.name in parsed_by_name else cached_header(file, st)
+        if isinstance(header, BaseException):
+            continue
+        entry = {"name": header["name"], "created": header["created"], "_path": file.path}
+        state.history.append(entry)
+        state.history_by_name[entry["name"]] = entry
+        fresh[file.name] = {"mtime": st.st_mtime_ns, "size": st.st_size, "entry": {"name": entry["name"], "created": entry["created"]}}
+
+    state.history_names_lower = sorted((n.lower(), n) for n in state.history_by_name)
+
+    # rewrite when anything was re-parsed or files disappeared
+    if stale or fresh.keys() != cache.keys():
+        await write_sidecar(state.history_dir, HISTORY_INDEX_FILE, fresh)
+
+    # stat after the index write, which itself bumps the dir mtime; after an I/O error
+    # leave it unset so the next reload retries the files we couldn't read
+    state.history_dir_mtime_ns = None if read_failed else os.stat(state.history_dir).st_mtime_ns
+    state.history_last_scan = time.monotonic()
+
     print(f"Loaded {len(state.history)} conversations from history.")
 
 
-def load_conversation(state: AppState, name: str) -> None:
+async def load_conversation(state: AppState, name: str) -> None:
     entry = state.history_by_name.get(name)
     if not entry:
         print("No conversation found with that name.")
         return
-    state.mem = entry["conversation"].copy()
+    try:
+        async with aiofiles.open(entry["_path"], "rb") as f:
+            data = decode_history(entry["_path"], await f.read())
+        mem = [from_wire(m) for m in json_loads(data)["conversation"]]
+    except OSError:
+        print("Conversation file not found on disk.")
+        return
+    except (ValueError, KeyError, TypeError):
+        # header indexed fine at startup but the body is truncated or malformed
+        print("Conversation file is corrupt and could not be loaded.")
+        return
+    state.mem = mem
     state.current_name = name
     print(f"Loaded conversation: {name}")
 
 
-def save_conversation(state: AppState, name: str) -> None:
+async def save_conversation(state: AppState, name: str) -> None:
     if not state.mem:
         return
 
     entry = {
         "name": name,
         "created": datetime.now().isoformat(timespec="seconds"),
-        "conversation": state.mem.copy(),
+        "conversation": [to_wire(m) for m in state.mem],
     }
 
     final_name, path = unique_path(state.history_dir, name)
     entry["name"] = final_name
 
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(entry, f, indent=2)
-
-    # update in-memory index so tab-complete sees it immediately
-    state.history.append(entry)
-    state.history_by_name[final_name] = entry
+    # encode up front so the file is written in one call instead of json.dump's many small chunks
+    data = encode_history(entry)
+    # write beside the reserved file and swap it in, so a crash never leaves a truncated conversation
+    tmp_path = f"{path}.tmp"
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            await f.write(data)
+        await aiofiles.os.replace(tmp_path, path)
+    except BaseException:
+        # give the name back instead of leaving an empty reservation and a stray .tmp
+        for leftover in (tmp_path, path):
+            try:
+                os.remove(leftover)
+            except OSError:
+                pass
+        raise
+    await write_sidecar(state.history_dir, TITLE_CACHE_FILE, state.title_cache)
+
+    # update in-memory index so tab-complete sees it immediately; the body stays on disk
+    header = {"name": final_name, "created": entry["created"], "_path": path}
+    state.history.append(header)
+    state.history_by_name[final_name] = header
+    bisect.insort(state.history_names_lower, (final_name.lower(), final_name))
+    state.history_dir_mtime_ns = None
     state.current_name = final_name
 
 
-def model_reply(state: AppState, messages: list[dict]) -> str:
-    resp = state.client.responses.create(model="gpt-5.2", input=messages)
+async def model_reply(state: AppState, messages: Iterable[Message]) -> str:
+    resp = await state.client.responses.create(model="gpt-5.2", input=[to_wire(m) for m in messages])
     return resp.output_text.strip()
 
 
-def generate_title_from_mem(state: AppState) -> str:
+async def generate_title_from_mem(state: AppState) -> str:
+    key = hashlib.blake2b(json_dumps([to_wire(m) for m in state.mem]), digest_size=16).hexdigest()
+    title = state.title_cache.get(key)
+    if title is not None:
+        return title
+
     # IMPORTANT: don't mutate the real conversation
-    temp = state.mem + [{"role": "user", "content": TITLE_PROMPT}]
-    return model_reply(state, temp)
+    temp = itertools.chain(state.mem, (Message("user", TITLE_PROMPT),))
+    title = await model_reply(state, temp)
+    state.title_cache[key] = title
+    return title
 
 
-def run_command(state: AppState, command_table: list[dict], line: str) -> bool:
+async def run_command(state: AppState, command_index: dict[str, dict], line: str) -> bool:
     normalized = line.strip()
     if not normalized:
         return False
@@ -147,28 +382,36 @@ def run_command(state: AppState, command_table: list[dict], line: str) -> bool:
     name = parts[0].lower()
     arg = parts[1].strip() if len(parts) == 2 else ""
 
-    cmd = next((c for c in command_table if c["command"] == name), None)
+    cmd = command_index.get(name)
     if not cmd:
         return False
 
     # command expects arg?
     if cmd.get("takes_arg", False):
-        cmd["func"](arg)
-        return True
-
-    if arg:
+        result = cmd["func"](arg)
+    elif arg:
         return False
+    else:
+        result = cmd["func"]()
 
-    cmd["func"]()
+    # some commands touch disk or the network and are coroutines
+    if inspect.isawaitable(result):
+        await result
     return True
 
 
-def main():
+async def main():
     base_dir = os.path.join(os.getenv("APPDATA"), "trashAItool")
     history_dir = os.path.join(base_dir, "history")
     os.makedirs(history_dir, exist_ok=True)
 
-    state = AppState(client=OpenAI(), session=PromptSession(), history_dir=history_dir)
+    # one pooled keep-alive client so the exit-time title request reuses the chat connection
+    http_client = httpx.AsyncClient(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=60),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+    state = AppState(client=AsyncOpenAI(http_client=http_client), session=PromptSession(), history_dir=history_dir)
 
     command_table = [
         {"command": "help",   "func": lambda:          cmd_help(command_table),      "description": "Show available commands"},
@@ -181,27 +424,31 @@ def main():
         {"command": "exit",   "func": lambda:          cmd_exit(state, generate_title_from_mem, sanitize_filename, save_conversation), "description": "Exit the application"},
     ]
 
+    command_index = {c["command"]: c for c in command_table}
     completer = AiCLICompleter(state, command_table)
 
-    print("trashAItool Enabled. CTRL+C to exit.")
-    print("Type 'help' for a list of commands.")
-    load_history(state)
+    # close the pooled connection ourselves; letting asyncio.run tear the loop down under it
+    # prints "Event loop is closed" noise on Windows' Proactor loop
+    async with http_client:
+        print("trashAItool Enabled. CTRL+C to exit.")
+        print("Type 'help' for a list of commands.")
+        await load_history(state)
 
-    while True:
-        try:
-            user = state.session.prompt("> ", completer=completer)
+        while True:
+            try:
+                user = await state.session.prompt_async("> ", completer=completer)
 
-            if run_command(state, command_table, user):
-                continue
+                if await run_command(state, command_index, user):
+                    continue
 
-        except SystemExit:
-            break
+            except SystemExit:
+                break
 
-        state.mem.append({"role": "user", "content": user})
-        reply = model_reply(state, state.mem)
-        print(YELLOW + reply + RESET)
-        state.mem.append({"role": "assistant", "content": reply})
+            state.mem.append(Message("user", user))
+            reply = await model_reply(state, state.mem)
+            print(YELLOW + reply + RESET)
+            state.mem.append(Message("assistant", reply))
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())